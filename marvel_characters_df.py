@@ -1,13 +1,16 @@
+import asyncio
 import os
+import random
 import time
 import hashlib
+import numpy as np
+from functools import cached_property
 import pandas as pd
 from pandas import DataFrame
-from typing import Dict, List
+from typing import Dict, List, Optional
 import logging
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+import httpx
+import orjson
 
 
 logging.basicConfig(
@@ -15,6 +18,9 @@ logging.basicConfig(
     level=logging.INFO,
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+# httpx logs every request url, including the auth params, at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+logging.getLogger('httpcore').setLevel(logging.WARNING)
 
 
 def env_config_keys() -> dict:
@@ -44,9 +50,23 @@ class APIClient:
 
     Attributes:
         base_url (str): Api url
+        max_workers (int): Max concurrent requests, kept low
+            to respect the Api rate limit
+        timeout (int): Seconds to wait for each request
+        retries (int): How many times to retry a request. These are
+            retries made on transport errors (connect, read, protocol)
+            and on responses where status code matches status_forcelist.
+        backoff_factor (int): A backoff factor to apply between attempts.
+        status_forcelist (tuple): A set of integer HTTP status codes
+            that we should force a retry on.
     '''
 
     base_url = 'https://gateway.marvel.com/v1/public/'
+    max_workers = 5
+    timeout = 30
+    retries = 5
+    backoff_factor = 2
+    status_forcelist = (500, 502, 504)
 
     def __init__(self, config: Dict) -> None:
         '''
@@ -56,6 +76,9 @@ class APIClient:
         self.config = config
         self.pub_key = config.get('public_key')
         self.private_key = config.get('private_key')
+        self._keys_bytes = (self.private_key + self.pub_key).encode()
+        self._timestamp = str(int(time.time()))
+        self._hash = self.gen_md5_hash(self._timestamp)
 
     def gen_md5_hash(self, timestamp: str) -> str:
         '''Method to generate md5 hash used to authenticate the request.
@@ -66,108 +89,137 @@ class APIClient:
         Returns:
             md5 digested key as string
         '''
-        key_string = timestamp+self.private_key+self.pub_key
-        key = hashlib.md5(key_string.encode())
+        key = hashlib.md5()
+        key.update(timestamp.encode())
+        key.update(self._keys_bytes)
         return key.hexdigest()
 
-    def requests_retry_session(
-        self,
-        retries: int = 5,
-        backoff_factor: int = 2,
-        status_forcelist: List = (500, 502, 504),
-        session: requests.Session = None,
-    ) -> requests.Session:
-        '''Method to start a request and retry session.
+    @cached_property
+    def _endpoint_url(self) -> str:
+        '''Full url of the client endpoint, built once per client.
 
-        Args:
-            retries (int): How many times to retry on bad status codes.
-                These are retries made on responses, where status code
-                matches status_forcelist.
-            backoff_factor (int):
-                A backoff factor to apply between attempts
-                after the second try.
-            status_forcelist (List):
-                A set of integer HTTP status codes that we should
-                force a retry on.
-            session (requests.Session): A request session used to
-                persist certain parameters across requests.
+        Returns:
+            The base url joined with the endpoint
+        '''
+        return self.base_url + self.endpoint
+
+    @cached_property
+    def _params_template(self) -> Dict:
+        '''Request parameters shared by every page, built once per client.
 
         Returns:
-            A request session
+            A Dict with every request parameter but offset
         '''
+        params = {
+            'apikey': self.pub_key,
+            'hash': self._hash,
+            'limit': self.limit,
+            'ts': self._timestamp
+        }
+
+        if self.config.get('modifiedSince'):
+            params['modifiedSince'] = self.config.get('modifiedSince')
+
+        return params
+
+    @cached_property
+    def client(self) -> httpx.AsyncClient:
+        '''Async HTTP/2 client, built once per client.
+
+        Note:
+            With HTTP/2 every concurrent request is multiplexed over one
+            connection. The client is closed by fetch_characters, so it
+            can not be reused after an extraction.
 
-        session = session or requests.Session()
-        retry = Retry(
-            total=retries,
-            read=retries,
-            connect=retries,
-            backoff_factor=backoff_factor,
-            status_forcelist=status_forcelist,
+        Returns:
+            An httpx async client
+        '''
+        transport = httpx.AsyncHTTPTransport(http2=True)
+        return httpx.AsyncClient(
+            timeout=self.timeout,
+            transport=transport
         )
 
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        return session
+    @cached_property
+    def semaphore(self) -> asyncio.Semaphore:
+        '''Semaphore limiting in flight requests to max_workers.
+
+        Returns:
+            An asyncio semaphore
+        '''
+        return asyncio.Semaphore(self.max_workers)
+
+    def get_backoff_time(self, attempt: int) -> float:
+        '''Method to get the time to sleep before retrying a request.
+
+        Note:
+            Uses full jitter, so concurrent retries are spread across the
+            backoff window instead of happening in lockstep.
 
-    def do_request(
+        Args:
+            attempt (int): Number of the failed attempt, starting on 0.
+
+        Returns:
+            Seconds to sleep
+        '''
+        return random.uniform(0, self.backoff_factor * 2 ** attempt)
+
+    async def do_request(
         self,
-        endpoint: str,
-        params: Dict,
-        session: requests.Session
-    ) -> requests.Response:
+        url: str,
+        params: Dict
+    ) -> Dict:
         '''Method to execute one request.
 
         Args:
-            endpoint (str): String with a valid Marvel endpoint.
-                Starts without /
-            params (Dict):
-                A backoff factor to apply between attempts
-                after the second try.
-            session (requests.Session): A request session.
+            url (str): Full url of a valid Marvel endpoint.
+            params (Dict): Query parameters of the request.
 
         Returns:
-            A raw request response.
+            A Dict containing the decoded response content.
         '''
-        url = f'{self.base_url}{endpoint}'
-
-        raw_response = self.requests_retry_session(session=session).get(
-            url, params=params
-        )
+        for attempt in range(self.retries + 1):
+            try:
+                # Held only while requesting, so backing off frees the slot
+                async with self.semaphore:
+                    raw_response = await self.client.get(url, params=params)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            else:
+                if (
+                    raw_response.status_code not in self.status_forcelist
+                    or attempt == self.retries
+                ):
+                    break
+            await asyncio.sleep(self.get_backoff_time(attempt))
 
         if raw_response.status_code != 200:
             logging.error('Something went wrong.')
-            raise Exception(raw_response.json())
+            raise Exception(orjson.loads(raw_response.content))
 
-        return raw_response
+        return orjson.loads(raw_response.content)
 
-    def sync(self, offset: int) -> Dict:
+    async def sync(self, offset: int) -> Dict:
         '''Method which builds and execute the request.
 
+        Note:
+            Marvel accepts a fixed ts, so the hash computed on __init__
+            authenticates every page of the extraction. Each request gets
+            its own copy of the params, as pages are fetched concurrently.
+
         Args:
             offset (int): Number of records to skip
 
         Returns:
             A Dict containing the response content
         '''
-        timestamp = str(int(time.time()))
-        params = {
-            'apikey': self.pub_key,
-            'hash': self.gen_md5_hash(timestamp),
-            'limit': self.limit,
-            'ts': timestamp,
-            'offset': offset
-        }
-
-        if self.config.get('modifiedSince'):
-            params['modifiedSince'] = self.config.get('modifiedSince')
+        params = {**self._params_template, 'offset': offset}
 
-        session = requests.Session()
-        response = self.do_request(
-            self.endpoint,
-            params,
-            session
-        ).json()
+        response = await self.do_request(
+            self._endpoint_url,
+            params
+        )
 
         return response
 
@@ -179,50 +231,105 @@ class Characters(APIClient):
         endpoint (str): Api endpoint
         limit (int): Api parameter to limit the result
             set to the specified number of resources
+        fields_to_select (list): Columns fields kept as they are
         fields_to_aggregate (list): Columns fields to be aggregated
-        df (DataFrame): Empty Pandas DF, will be populated later.
+        df (DataFrame): Instance attribute, only created by build_df
+            once all pages were collected.
     '''
     endpoint = 'characters'
     limit = 100
+    fields_to_select = ['id', 'name', 'description']
     fields_to_aggregate = ['comics',  'series',  'stories', 'events']
-    df = DataFrame()
+
+    def __init__(self, config: Dict, limit: Optional[int] = None) -> None:
+        '''
+        Args:
+            config (obj):  Python dict containing private_key and public_key.
+            limit (int): Overrides the default page size, if the
+                endpoint permits.
+        '''
+        super().__init__(config)
+        if limit:
+            self.limit = limit
+        self._columns: Dict[str, List] = {
+            col: [] for col in self.fields_to_select + self.fields_to_aggregate
+        }
 
     def append_data_to_df(self, results: List[Dict]) -> None:
-        '''Method which add a data to characters df
+        '''Method which collects a page of characters
+
+        Note:
+            Only the desired fields are copied from each character, so the
+            raw dicts can be released as soon as the page is consumed.
+            The DataFrame is built only once, after all pages were
+            collected, avoiding a full copy on every page.
 
         Args:
             results (List[Dict]): A list with each item as a character dict
 
         Returns:
-            No directy result, but this affects the class df
+            No directy result, but this affects the class columns
         '''
-        results_df = pd.DataFrame.from_dict(results)
-        self.df = pd.concat([self.df, results_df], ignore_index=True)
+        columns = self._columns
+        for character in results:
+            for col in self.fields_to_select:
+                columns[col].append(character[col])
+            for col in self.fields_to_aggregate:
+                columns[col].append(character[col]['available'])
 
-    def aggregate_df_columns(self) -> None:
-        '''Method which filter get the aggregated results of each col
+    def build_df(self) -> None:
+        '''Method which builds the characters df from the collected columns
 
-        Returns:
-            No directy result, but this affects the class df
-        '''
-        for col in self.fields_to_aggregate:
-            self.df[col] = self.df[col].map(lambda x: x['available'])
-
-    def clean_df_extra_column(self) -> None:
-        '''Method which select the desired columns
+        Note:
+            Numeric columns are built as narrow typed arrays, skipping
+            pandas type inference.
 
         Returns:
             No directy result, but this affects the class df
         '''
-        self.df = self.df[[
-            'id',
-            'name',
-            'description',
-            'comics',
-            'series',
-            'stories',
-            'events'
-        ]]
+        columns = self._columns
+        self.df = pd.DataFrame({
+            'id': np.array(columns['id'], dtype=np.int32),
+            'name': columns['name'],
+            'description': columns['description'],
+            **{
+                col: np.array(columns[col], dtype=np.int32)
+                for col in self.fields_to_aggregate
+            }
+        })
+
+
+async def fetch_characters(characters_endpoint: Characters) -> None:
+    '''Fetch every characters page, all but the first one concurrently.
+
+    Args:
+        characters_endpoint (Characters): Endpoint collecting the pages.
+    '''
+    async with characters_endpoint.client:
+        characters_data = await characters_endpoint.sync(0)
+        total = characters_data['data']['total']
+        results = characters_data['data']['results']
+        characters_endpoint.append_data_to_df(results)
+        fetched = len(results)
+        logging.info('Extracted %d of %d total.', fetched, total)
+
+        limit = characters_data['data']['limit'] or characters_endpoint.limit
+        tasks = [
+            asyncio.ensure_future(characters_endpoint.sync(offset))
+            for offset in range(limit, total, limit)
+        ]
+        try:
+            for task in tasks:
+                characters_data = await task
+                results = characters_data['data']['results']
+                characters_endpoint.append_data_to_df(results)
+                fetched += len(results)
+                logging.info('Extracted %d of %d total.', fetched, total)
+        finally:
+            # On failure, stop in flight pages before the client is closed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
 
 def extract_dataframe() -> DataFrame:
@@ -230,26 +337,15 @@ def extract_dataframe() -> DataFrame:
     characters_endpoint = Characters(config)
 
     logging.info('Starting extraction')
-    characters_data = characters_endpoint.sync(0)
-    offset = characters_data['data']['offset']
-    total = characters_data['data']['total']
-
-    while offset < total:
-        results = characters_data['data']['results']
-        characters_endpoint.append_data_to_df(results)
-
-        offset += 100
-        characters_data = characters_endpoint.sync(offset)
-        logging.info(
-            f'Extrated {len(characters_endpoint.df)} of {total} total.'
-        )
+    asyncio.run(fetch_characters(characters_endpoint))
 
     logging.info('End extraction')
-    characters_endpoint.aggregate_df_columns()
-    characters_endpoint.clean_df_extra_column()
+    characters_endpoint.build_df()
 
-    # Uncomment the line bellow to export a csv
-    # characters_endpoint.df.to_csv('characters.csv')
+    # Uncomment the lines bellow to export a parquet file
+    # characters_endpoint.df.to_parquet(
+    #     'characters.parquet', engine='pyarrow', compression='zstd'
+    # )
 
     return characters_endpoint.df
 
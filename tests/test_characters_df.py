@@ -1,5 +1,193 @@
+import asyncio
+import hashlib
 import unittest
-from marvel_characters_df import extract_dataframe
+import unittest.mock
+import httpx
+from marvel_characters_df import (
+    APIClient,
+    Characters,
+    extract_dataframe,
+    fetch_characters
+)
+
+CONFIG = {
+    'public_key': 'S0M3pUBl1CK3Y',
+    'private_key': 'S0M3pR1V3T3k3y'
+}
+
+
+def character(character_id: int) -> dict:
+    return {
+        'id': character_id,
+        'name': f'Character {character_id}',
+        'description': '',
+        'comics': {'available': 1},
+        'series': {'available': 2},
+        'stories': {'available': 3},
+        'events': {'available': 4}
+    }
+
+
+class TestAPIClient(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient(CONFIG)
+
+    def test_gen_md5_hash(self) -> None:
+        '''
+            Testing if the hash matches md5(ts+private_key+public_key)
+        '''
+        self.assertEqual(
+            hashlib.md5(b'1S0M3pR1V3T3k3yS0M3pUBl1CK3Y').hexdigest(),
+            self.client.gen_md5_hash('1'),
+            'Hash not equal expected md5 digest'
+        )
+
+    def test_get_backoff_time(self) -> None:
+        '''
+            Testing if the jittered backoff stays in a growing window
+        '''
+        # With the lower bound drawn, retries may happen right away
+        with unittest.mock.patch('random.uniform', lambda a, b: a):
+            self.assertEqual(
+                [0] * 5,
+                [self.client.get_backoff_time(n) for n in range(5)]
+            )
+
+        with unittest.mock.patch('random.uniform', lambda a, b: b):
+            self.assertEqual(
+                [2, 4, 8, 16, 32],
+                [self.client.get_backoff_time(n) for n in range(5)]
+            )
+
+
+class TestBuildDF(unittest.TestCase):
+    def test_build_df(self) -> None:
+        '''
+            Testing if the built df has the desired columns and dtypes
+        '''
+        endpoint = Characters(CONFIG)
+        big = character(2)
+        big['stories'] = {'available': 40000}
+        endpoint.append_data_to_df([character(1), big])
+        endpoint.build_df()
+
+        self.assertEqual(
+            [
+                "id",
+                "name",
+                "description",
+                "comics",
+                "series",
+                "stories",
+                "events"
+            ],
+            endpoint.df.columns.values.tolist(),
+            'Final df columns not equal expected columns'
+        )
+        numeric_columns = ['id', 'comics', 'series', 'stories', 'events']
+        self.assertEqual(
+            ['int32'] * len(numeric_columns),
+            endpoint.df[numeric_columns].dtypes.astype(str).tolist(),
+            'Numeric columns dtypes not equal int32'
+        )
+        self.assertEqual([3, 40000], endpoint.df['stories'].tolist())
+
+
+class TestFetchCharacters(unittest.TestCase):
+    total = 250
+    # Differs from Characters.limit, as if the api capped the page size
+    limit = 40
+
+    def setUp(self) -> None:
+        self.offsets = []
+        self.failures = {}
+        self.echoed_limit = self.limit
+        self.endpoint = Characters(CONFIG)
+        self.endpoint.backoff_factor = 0
+        self.endpoint.client = httpx.AsyncClient(
+            transport=httpx.MockTransport(self.handler)
+        )
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        offset = int(request.url.params['offset'])
+        self.offsets.append(offset)
+        if self.failures.get(offset):
+            return httpx.Response(
+                self.failures[offset].pop(0),
+                json={'code': 'Error', 'message': 'Something went wrong'}
+            )
+        ids = range(offset, min(offset + self.limit, self.total))
+        return httpx.Response(200, json={'data': {
+            'offset': offset,
+            'limit': self.echoed_limit,
+            'total': self.total,
+            'count': len(ids),
+            'results': [character(i) for i in ids]
+        }})
+
+    def test_fetch_offsets(self) -> None:
+        '''
+            Testing if every page is requested once, without
+            a trailing request after the total
+        '''
+        asyncio.run(fetch_characters(self.endpoint))
+
+        self.assertEqual(
+            list(range(0, self.total, self.limit)),
+            sorted(self.offsets),
+            'Requested offsets not equal expected offsets'
+        )
+        self.assertEqual(
+            list(range(self.total)),
+            self.endpoint._columns['id'],
+            'Collected ids not equal expected ids'
+        )
+
+    def test_fetch_without_echoed_limit(self) -> None:
+        '''
+            Testing if pages fall back to the requested limit
+            when the api echoes no limit
+        '''
+        self.echoed_limit = 0
+        asyncio.run(fetch_characters(self.endpoint))
+
+        self.assertEqual(
+            list(range(0, self.total, self.endpoint.limit)),
+            sorted(self.offsets),
+            'Requested offsets not equal expected offsets'
+        )
+
+    def test_fetch_does_not_log_auth_params(self) -> None:
+        '''
+            Testing if the request url, with the auth params,
+            never reaches INFO logs
+        '''
+        with self.assertLogs(level='INFO') as logs:
+            asyncio.run(fetch_characters(self.endpoint))
+
+        for message in logs.output:
+            self.assertNotIn('hash=', message)
+            self.assertNotIn(CONFIG['public_key'], message)
+
+    def test_fetch_retries_server_error(self) -> None:
+        '''
+            Testing if a page is requested again after a 500
+        '''
+        self.failures[self.limit] = [500]
+        asyncio.run(fetch_characters(self.endpoint))
+
+        self.assertEqual(2, self.offsets.count(self.limit))
+        self.assertEqual(self.total, len(self.endpoint._columns['id']))
+
+    def test_fetch_raises_client_error(self) -> None:
+        '''
+            Testing if a 409 is not retried and raises
+        '''
+        self.failures[self.limit] = [409]
+
+        with self.assertRaises(Exception):
+            asyncio.run(fetch_characters(self.endpoint))
+        self.assertEqual(1, self.offsets.count(self.limit))
 
 
 class TestCharactersDF(unittest.TestCase):